@@ -2,31 +2,59 @@
 TopLenderGuide.com — Backend API
 """
 
-from fastapi import FastAPI, HTTPException, Depends, Header, Query
+from fastapi import FastAPI, HTTPException, Depends, Header, Path, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from contextlib import asynccontextmanager
-import io, csv
+from datetime import datetime, timedelta, timezone
+from typing import Literal
+from anyio import to_thread
+import hashlib
+import threading
+import weakref
+import orjson
 import uvicorn
 import os
 
-from database import init_db, get_all_rates, get_rate_history, upsert_rates, get_all_history, get_history_stats
+from database import (DatabaseBusy, init_db, close_db, has_recent_rates, get_last_updated, get_all_rates,
+                      get_rate_history,
+                      upsert_rates, get_all_history, history_to_columns,
+                      get_history_stats)
+from exports import iter_csv, start_export, export_status, export_file
+from cache import cached
 from scheduler import start_scheduler, stop_scheduler
-from rate_updater import fetch_latest_rates
+from rate_updater import fetch_latest_rates_async
+
+# Sync endpoints run on AnyIO's worker thread pool (Starlette default: 40).
+# Size it together with DB_POOL_SIZE/DB_MAX_OVERFLOW when tuning concurrency.
+API_THREADPOOL_SIZE = int(os.getenv("API_THREADPOOL_SIZE", "40"))
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    to_thread.current_default_thread_limiter().total_tokens = API_THREADPOOL_SIZE
     init_db()
-    upsert_rates(fetch_latest_rates())
+    # Seed only a cold or stale database; warm restarts leave the refresh
+    # to the scheduler instead of blocking startup on FRED + an upsert.
+    if not has_recent_rates():
+        upsert_rates(await fetch_latest_rates_async())
     start_scheduler()
     yield
-    stop_scheduler()
+    await stop_scheduler()  # lets an in-flight upsert finish before the DB closes
+    close_db()
+
+class ORJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson (C-level encoder) instead of stdlib json."""
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
 
 app = FastAPI(
     title="TopLenderGuide Rate API",
     description="Daily mortgage rate backend for toplenderguide.com",
     version="2.0.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 app.add_middleware(
@@ -36,92 +64,232 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# History JSON and the CSV export are highly repetitive text; compress
+# anything over 1 KB for clients that send Accept-Encoding: gzip.
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
+
+@app.exception_handler(DatabaseBusy)
+def database_busy(request: Request, exc: DatabaseBusy):
+    return ORJSONResponse({"detail": "Database busy, retry shortly"}, status_code=503,
+                          headers={"Retry-After": "5"})
+
 ADMIN_KEY = os.getenv("ADMIN_API_KEY", "change-me-in-production")
 
+EXPORT_JOB_ID = r"^[0-9a-f]{16}$"
+
 def require_admin(x_api_key: str = Header(...)):
     if x_api_key != ADMIN_KEY:
         raise HTTPException(status_code=401, detail="Invalid API key")
 
 
+# ── HTTP caching ─────────────────────────────────────────────────────────────
+# Data changes only when upsert_rates runs, so responses are keyed on the
+# latest snapshot timestamp and browsers/CDNs can revalidate with a 304.
+
+API_CACHE_CONTROL = "public, max-age=300, stale-while-revalidate=3600"
+CSV_CACHE_CONTROL = "public, max-age=86400"
+
+def _not_modified(request: Request, response: Response, variant: str,
+                  cache_control: str = API_CACHE_CONTROL) -> Response | None:
+    """
+    Set ETag/Cache-Control on `response`; returns a 304 response instead if
+    the client already holds this version.
+    """
+    version = cached("version:v2", get_last_updated)
+    etag = 'W/"%s"' % hashlib.sha1(f"{version}|{variant}".encode()).hexdigest()[:20]
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    client_tags = {t.strip() for t in request.headers.get("if-none-match", "").split(",")}
+    if etag in client_tags or "*" in client_tags:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
 # ── Public endpoints ─────────────────────────────────────────────────────────
 
 @app.get("/")
-def root():
+async def root():
     return {"status": "ok", "service": "TopLenderGuide Rate API v2"}
 
 
 @app.get("/api/rates")
-def get_rates():
+def get_rates(request: Request, response: Response):
     """Latest rate snapshot for all lenders."""
-    rates = get_all_rates()
+    if not_modified := _not_modified(request, response, "rates"):
+        return not_modified
+    rates = cached("rates:v2", get_all_rates)
     return {
         "updated_at": rates[0]["updated_at"] if rates else None,
         "lenders": rates
     }
 
 
+LENDER_HISTORY_MAX_DAYS = 365
+
 @app.get("/api/rates/{lender_id}")
-def get_lender_rate(lender_id: str, days: int = Query(default=90, ge=1, le=365)):
+def get_lender_rate(request: Request, response: Response, lender_id: str,
+                    days: int = Query(default=90, ge=1, le=LENDER_HISTORY_MAX_DAYS)):
     """Current rate + history for one lender."""
-    history = get_rate_history(lender_id, days=days)
+    if not_modified := _not_modified(request, response, f"lender:{lender_id}:{days}"):
+        return not_modified
+    # Check against the cached snapshot first so unknown ids never reach
+    # the DB or create cache entries.
+    if not any(r["lender_id"] == lender_id for r in cached("rates:v2", get_all_rates)):
+        raise HTTPException(status_code=404, detail="Lender not found")
+    # One cached series per lender (max window); shorter windows are a slice.
+    history = cached(f"lender:{lender_id}:v2",
+                     lambda: get_rate_history(lender_id, days=LENDER_HISTORY_MAX_DAYS))[:days]
     if not history:
         raise HTTPException(status_code=404, detail="Lender not found")
     return {"lender_id": lender_id, "history": history}
 
 
+HISTORY_MAX_DAYS = 365
+
+
+def _recorded_since(rows: list[dict], days: int) -> list[dict]:
+    """Leading rows (newest first) recorded within the last `days` days."""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    lo, hi = 0, len(rows)
+    while lo < hi:  # first row older than the cutoff
+        mid = (lo + hi) // 2
+        if datetime.fromisoformat(rows[mid]["recorded_at"]) >= cutoff:
+            lo = mid + 1
+        else:
+            hi = mid
+    return rows[:lo]
+
+
 @app.get("/api/history")
-def get_history(days: int = Query(default=90, ge=1, le=365)):
+def get_history(request: Request, response: Response,
+                days: int = Query(default=90, ge=1, le=HISTORY_MAX_DAYS),
+                format: Literal["columns", "rows"] = "columns"):
     """
     Full rate history for ALL lenders for the past N days.
     Used by the frontend chart and data dashboard.
+
+    format=columns (default): {"columns": [...], "data": {col: [...]}, "lenders": {id: name}}
+    format=rows             : legacy list of per-row objects
     """
-    rows = get_all_history(days=days)
-    stats = get_history_stats()
+    if not_modified := _not_modified(request, response, f"history:{days}:{format}"):
+        return not_modified
+    # One cached max-window row set; shorter windows are filtered from it,
+    # so the cache holds one entry however many `days` values are asked for.
+    history = _recorded_since(
+        cached("history:v2", lambda: get_all_history(days=HISTORY_MAX_DAYS)), days)
+    if format == "columns":
+        history = history_to_columns(history)
+    stats = cached("stats:v2", get_history_stats)
     return {
         "days_requested": days,
         "stats": stats,
-        "history": rows
+        "history": history
     }
 
 
+# A streamed CSV keeps its DB connection (and, on Postgres, a pool slot) for
+# the whole download, so only a few may run at once — fewer than the pool,
+# leaving room for normal reads and the daily upsert.
+CSV_MAX_STREAMS = int(os.getenv("CSV_MAX_STREAMS", "3"))
+_csv_streams = threading.BoundedSemaphore(CSV_MAX_STREAMS)
+
+
+class _CsvStream:
+    """Yields `chunks`, then frees its _csv_streams slot — exactly once, also if
+    the client disconnects or the stream is dropped before it ever starts."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._release = weakref.finalize(self, _csv_streams.release)
+
+    def __iter__(self):
+        try:
+            yield from self._chunks
+        finally:
+            self._release()
+
+
 @app.get("/api/export.csv")
-def export_csv(days: int = Query(default=365, ge=1, le=3650)):
+def export_csv(request: Request, response: Response,
+               days: int = Query(default=365, ge=1, le=3650)):
     """
     Download all historical rate data as a CSV file.
     No auth required — data is public.
+    Rows are streamed straight from the DB cursor, so memory use stays flat
+    regardless of the requested range.
     """
-    rows = get_all_history(days=days)
-
-    output = io.StringIO()
-    writer = csv.DictWriter(output, fieldnames=[
-        "recorded_at", "lender_id", "lender_name",
-        "rate_30yr", "rate_15yr", "rate_arm_5_1", "apr_30yr"
-    ])
-    writer.writeheader()
-    for r in rows:
-        writer.writerow({k: r.get(k, "") for k in writer.fieldnames})
-
-    output.seek(0)
+    if not_modified := _not_modified(request, response, f"csv:{days}", CSV_CACHE_CONTROL):
+        return not_modified
+    if not _csv_streams.acquire(blocking=False):
+        raise HTTPException(status_code=429, detail="Too many CSV downloads in progress, retry later",
+                            headers={"Retry-After": "30"})
     return StreamingResponse(
-        iter([output.getvalue()]),
+        _CsvStream(iter_csv(days)),
         media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename=toplenderguide_rates_{days}days.csv"}
+        headers={
+            "Content-Disposition": f"attachment; filename=toplenderguide_rates_{days}days.csv",
+            "ETag":                response.headers["etag"],
+            "Cache-Control":       response.headers["cache-control"],
+        }
     )
 
 
+@app.post("/api/export/jobs", status_code=202)
+def create_export_job(days: int = Query(default=365, ge=1, le=3650)):
+    """
+    Build the CSV export in the background instead of holding the request
+    open. Poll the returned job until it is done, then download it.
+    """
+    job_id = start_export(days)
+    if job_id is None:
+        raise HTTPException(status_code=429, detail="Too many exports in progress, retry later",
+                            headers={"Retry-After": "30"})
+    return _export_job(job_id, export_status(job_id))
+
+
+@app.get("/api/export/jobs/{job_id}")
+def get_export_job(job_id: str = Path(pattern=EXPORT_JOB_ID)):
+    """Status of a background export; includes the download URL once done."""
+    status = export_status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    return _export_job(job_id, status)
+
+
+@app.get("/api/export/jobs/{job_id}/download")
+def download_export_job(job_id: str = Path(pattern=EXPORT_JOB_ID)):
+    """Gzipped CSV produced by a finished export job."""
+    path = export_file(job_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Export not ready")
+    return FileResponse(path, media_type="application/gzip",
+                        filename=f"toplenderguide_rates_{job_id}.csv.gz")
+
+
+def _export_job(job_id: str, status: str | None) -> dict:
+    return {
+        "job_id": job_id,
+        "status": status,
+        "url": f"/api/export/jobs/{job_id}/download" if status == "done" else None,
+    }
+
+
 @app.get("/api/stats")
-def get_stats():
+def get_stats(request: Request, response: Response):
     """Summary statistics about stored rate history."""
-    return get_history_stats()
+    if not_modified := _not_modified(request, response, "stats"):
+        return not_modified
+    return cached("stats:v2", get_history_stats)
 
 
 # ── Admin endpoints (require API key) ────────────────────────────────────────
 
 @app.post("/admin/refresh", dependencies=[Depends(require_admin)])
-def manual_refresh():
+async def manual_refresh():
     """Force an immediate rate update (bypasses scheduler)."""
-    rates = fetch_latest_rates()
-    upsert_rates(rates)
+    rates = await fetch_latest_rates_async()
+    await to_thread.run_sync(upsert_rates, rates)
     return {
         "status": "ok",
         "updated": len(rates),
@@ -0,0 +1,93 @@
+"""
+cache.py — Read-through cache for API responses.
+
+Rates change once per day, so the read endpoints cache their query results
+until the next upsert_rates() invalidates them (CACHE_TTL is a safety net).
+
+Auto-detects the backend:
+  • If REDIS_URL env var is set → shared Redis cache (all workers see the same data)
+  • Otherwise                   → per-process in-memory cache
+
+Redis failures never fail a request — the value is recomputed instead.
+"""
+
+import os
+import time
+import fnmatch
+import threading
+from decimal import Decimal
+
+import orjson
+
+REDIS_URL = os.getenv("REDIS_URL", "")
+CACHE_TTL = int(os.getenv("CACHE_TTL", "3600"))
+
+if REDIS_URL:
+    try:
+        import redis
+        _redis = redis.Redis.from_url(REDIS_URL)
+        print("[Cache] Using Redis")
+    except ImportError:
+        print("[Cache] WARNING: redis not installed — falling back to in-memory cache")
+        _redis = None
+else:
+    _redis = None
+
+_local: dict[str, tuple[float, object]] = {}
+_local_lock = threading.Lock()
+
+
+def _json_default(o):
+    # orjson handles datetime natively; NUMERIC columns arrive as Decimal
+    if isinstance(o, Decimal):
+        return float(o)
+    raise TypeError(f"Cannot serialize {type(o).__name__}")
+
+
+def cached(key: str, fn, ttl: int = CACHE_TTL):
+    """Return the cached value for key, or compute it with fn() and store it."""
+    if _redis is not None:
+        try:
+            hit = _redis.get(key)
+            if hit is not None:
+                return orjson.loads(hit)
+        except redis.RedisError as e:
+            print(f"[Cache] GET {key} failed: {e}")
+            return fn()
+        value = fn()
+        try:
+            _redis.set(key, orjson.dumps(value, default=_json_default), ex=ttl)
+        except redis.RedisError as e:
+            print(f"[Cache] SET {key} failed: {e}")
+        return value
+
+    now = time.monotonic()
+    hit = _local.get(key)
+    if hit is not None and hit[0] > now:
+        return hit[1]
+    value = fn()
+    with _local_lock:
+        _local[key] = (now + ttl, value)
+    return value
+
+
+def invalidate(*patterns: str):
+    """Drop cached keys; patterns may use glob wildcards (e.g. "history:*")."""
+    if _redis is not None:
+        try:
+            keys = set()
+            for p in patterns:
+                if any(c in p for c in "*?["):
+                    keys.update(_redis.scan_iter(match=p))
+                else:
+                    keys.add(p)
+            if keys:
+                _redis.delete(*keys)
+        except redis.RedisError as e:
+            print(f"[Cache] Invalidate failed: {e}")
+        return
+
+    with _local_lock:
+        for k in list(_local):
+            if any(fnmatch.fnmatchcase(k, p) for p in patterns):
+                del _local[k]
@@ -9,13 +9,20 @@ Schema
 ------
 rates        : latest rate snapshot per lender (one row per lender, upserted daily)
 rate_history : time-series of every recorded rate — never deleted, grows daily
+history_stats: single-row summary of rate_history, maintained by upsert_rates
 """
 
 import os
+import queue
 import sqlite3
-from datetime import datetime, timezone
+import threading
+from contextlib import contextmanager
+from uuid import uuid4
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
+import cache
+
 # ── Engine detection ─────────────────────────────────────────────────────────
 DATABASE_URL = os.getenv("DATABASE_URL", "")
 
@@ -25,6 +32,7 @@ if DATABASE_URL:
     try:
         import psycopg2
         import psycopg2.extras
+        import psycopg2.pool
         _USE_POSTGRES = True
         print("[DB] Using PostgreSQL")
     except ImportError:
@@ -35,81 +43,278 @@ else:
 
 DB_PATH = os.getenv("DB_PATH", "rates.db")
 
+# Postgres pool sizing: DB_POOL_SIZE connections are kept open, up to
+# DB_MAX_OVERFLOW more are opened under load.
+DB_POOL_SIZE     = int(os.getenv("DB_POOL_SIZE", "2"))
+DB_MAX_OVERFLOW  = int(os.getenv("DB_MAX_OVERFLOW", "8"))
+# Seconds to wait for a free pooled connection before giving up (DatabaseBusy)
+DB_POOL_TIMEOUT  = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+
+# Rows fetched per round trip by streaming (server-side) cursors
+STREAM_ITERSIZE = int(os.getenv("DB_STREAM_ITERSIZE", "2000"))
+
 
 # ── Connections ───────────────────────────────────────────────────────────────
+# Connections are created lazily on first use (one Postgres pool, or one SQLite
+# write handle plus a pool of read handles, per process) and reused across
+# requests instead of reconnecting per query.
+
+_pg_pool = None
+_pg_slots = threading.BoundedSemaphore(DB_POOL_SIZE + DB_MAX_OVERFLOW)
+_sqlite = None                        # write connection
+_sqlite_readers = queue.SimpleQueue()  # idle read connections
+_init_lock = threading.Lock()
+_sqlite_write_lock = threading.Lock()
+
+
+def _get_pg_pool():
+    global _pg_pool
+    if _pg_pool is None:
+        with _init_lock:
+            if _pg_pool is None:
+                _pg_pool = psycopg2.pool.ThreadedConnectionPool(
+                    minconn=DB_POOL_SIZE,
+                    maxconn=DB_POOL_SIZE + DB_MAX_OVERFLOW,
+                    dsn=DATABASE_URL,
+                )
+    return _pg_pool
+
 
+class DatabaseBusy(Exception):
+    """No pooled connection became free within DB_POOL_TIMEOUT seconds."""
+
+
+@contextmanager
 def _pg_conn():
-    conn = psycopg2.connect(DATABASE_URL)
-    conn.autocommit = False
-    return conn
+    """
+    Borrow a pooled connection; commits on success. Waits up to DB_POOL_TIMEOUT
+    while the pool is exhausted (ThreadedConnectionPool itself would raise at
+    once), then raises DatabaseBusy.
+    """
+    pool = _get_pg_pool()
+    if not _pg_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        raise DatabaseBusy(f"no database connection free after {DB_POOL_TIMEOUT:g}s")
+    try:
+        conn = pool.getconn()
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            # putconn() rolls back anything left uncommitted and discards
+            # broken connections.
+            pool.putconn(conn)
+    finally:
+        _pg_slots.release()
+
 
-def _sqlite_conn():
-    conn = sqlite3.connect(DB_PATH)
+def _open_sqlite():
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA cache_size=-64000")
     return conn
 
 
+def _get_sqlite():
+    """The single write connection."""
+    global _sqlite
+    if _sqlite is None:
+        with _init_lock:
+            if _sqlite is None:
+                _sqlite = _open_sqlite()
+    return _sqlite
+
+
+@contextmanager
+def _sqlite_conn(write: bool = False):
+    """
+    SQLite connection (autocommit). Reads borrow a pooled read connection, so
+    under WAL they see only committed data and never run inside the writer's
+    open transaction. With write=True the block runs on the shared write
+    connection as a single IMMEDIATE transaction, serialized across threads.
+    """
+    if not write:
+        try:
+            conn = _sqlite_readers.get_nowait()
+        except queue.Empty:
+            conn = _open_sqlite()
+        try:
+            yield conn
+        finally:
+            _sqlite_readers.put(conn)
+        return
+    conn = _get_sqlite()
+    with _sqlite_write_lock:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+def close_db():
+    """Release pooled connections (called on application shutdown)."""
+    global _pg_pool, _sqlite
+    with _init_lock:
+        if _pg_pool is not None:
+            _pg_pool.closeall()
+            _pg_pool = None
+        if _sqlite is not None:
+            _sqlite.close()
+            _sqlite = None
+        while True:
+            try:
+                _sqlite_readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+
 # ── Schema ────────────────────────────────────────────────────────────────────
+# The DDL is skipped entirely when _SCHEMA_MARKER already exists, so worker
+# start-up doesn't re-run (and lock the catalog for) a no-op DDL block.
+# Keep it pointing at the newest object created below.
+_SCHEMA_MARKER = "history_stats"
 
 def init_db():
     if _USE_POSTGRES:
         with _pg_conn() as conn:
             with conn.cursor() as cur:
-                cur.execute("""
+                # Serialize concurrent worker start-ups on the schema check
+                cur.execute("SELECT pg_advisory_xact_lock(hashtext('toplenderguide_schema'))")
+                cur.execute("SELECT to_regclass(%s)", (_SCHEMA_MARKER,))
+                if cur.fetchone()[0] is None:
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS rates (
+                            lender_id    TEXT PRIMARY KEY,
+                            lender_name  TEXT NOT NULL,
+                            rate_30yr    NUMERIC(5,2) NOT NULL,
+                            rate_15yr    NUMERIC(5,2) NOT NULL,
+                            rate_arm_5_1 NUMERIC(5,2) NOT NULL,
+                            apr_30yr     NUMERIC(5,2) NOT NULL,
+                            min_credit   INTEGER NOT NULL,
+                            min_down_pct NUMERIC(5,2) NOT NULL,
+                            updated_at   TIMESTAMPTZ NOT NULL
+                        );
+                        CREATE TABLE IF NOT EXISTS rate_history (
+                            id           SERIAL PRIMARY KEY,
+                            lender_id    TEXT NOT NULL,
+                            rate_30yr    NUMERIC(5,2) NOT NULL,
+                            rate_15yr    NUMERIC(5,2) NOT NULL,
+                            rate_arm_5_1 NUMERIC(5,2) NOT NULL,
+                            apr_30yr     NUMERIC(5,2) NOT NULL,
+                            recorded_at  TIMESTAMPTZ NOT NULL
+                        );
+                        CREATE INDEX IF NOT EXISTS idx_rates_30yr
+                            ON rates (rate_30yr)
+                            INCLUDE (lender_id, lender_name, rate_15yr, rate_arm_5_1, apr_30yr,
+                                     min_credit, min_down_pct, updated_at);
+                        CREATE INDEX IF NOT EXISTS idx_history_lender_cover
+                            ON rate_history (lender_id, recorded_at DESC)
+                            INCLUDE (rate_30yr, rate_15yr, rate_arm_5_1, apr_30yr);
+                        DROP INDEX IF EXISTS idx_history_lender;
+                        CREATE INDEX IF NOT EXISTS idx_history_date
+                            ON rate_history (recorded_at DESC);
+                        -- One history row per lender per (UTC) day. Rows written
+                        -- before this index existed are de-duplicated once.
+                        DO $$
+                        BEGIN
+                            IF to_regclass('uq_history_day') IS NULL THEN
+                                DELETE FROM rate_history a
+                                USING rate_history b
+                                WHERE a.lender_id = b.lender_id
+                                  AND (a.recorded_at AT TIME ZONE 'UTC')::date
+                                    = (b.recorded_at AT TIME ZONE 'UTC')::date
+                                  AND a.id > b.id;
+                                CREATE UNIQUE INDEX uq_history_day
+                                    ON rate_history (lender_id, ((recorded_at AT TIME ZONE 'UTC')::date));
+                            END IF;
+                        END $$;
+                        CREATE TABLE IF NOT EXISTS history_stats (
+                            id           BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                            total_rows   BIGINT NOT NULL,
+                            lender_count INTEGER NOT NULL,
+                            days_covered INTEGER NOT NULL,
+                            earliest     TIMESTAMPTZ,
+                            latest       TIMESTAMPTZ
+                        );
+                    """)
+                cur.execute("SELECT 1 FROM history_stats")
+                if cur.fetchone() is None:
+                    # One-time backfill; upsert_rates keeps it current afterwards
+                    cur.execute("""
+                        INSERT INTO history_stats
+                            (total_rows, lender_count, days_covered, earliest, latest)
+                        SELECT COUNT(*),
+                               COUNT(DISTINCT lender_id),
+                               COUNT(DISTINCT (recorded_at AT TIME ZONE 'UTC')::date),
+                               MIN(recorded_at),
+                               MAX(recorded_at)
+                        FROM rate_history
+                    """)
+    else:
+        # DDL runs in autocommit on the write connection (executescript would
+        # commit a BEGIN IMMEDIATE early), serialized with upsert_rates.
+        with _sqlite_write_lock:
+            conn = _get_sqlite()
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?",
+                            (_SCHEMA_MARKER,)).fetchone() is None:
+                conn.executescript("""
                     CREATE TABLE IF NOT EXISTS rates (
                         lender_id    TEXT PRIMARY KEY,
                         lender_name  TEXT NOT NULL,
-                        rate_30yr    NUMERIC(5,2) NOT NULL,
-                        rate_15yr    NUMERIC(5,2) NOT NULL,
-                        rate_arm_5_1 NUMERIC(5,2) NOT NULL,
-                        apr_30yr     NUMERIC(5,2) NOT NULL,
+                        rate_30yr    REAL NOT NULL,
+                        rate_15yr    REAL NOT NULL,
+                        rate_arm_5_1 REAL NOT NULL,
+                        apr_30yr     REAL NOT NULL,
                         min_credit   INTEGER NOT NULL,
-                        min_down_pct NUMERIC(5,2) NOT NULL,
-                        updated_at   TIMESTAMPTZ NOT NULL
+                        min_down_pct REAL NOT NULL,
+                        updated_at   TEXT NOT NULL
                     );
                     CREATE TABLE IF NOT EXISTS rate_history (
-                        id           SERIAL PRIMARY KEY,
+                        id           INTEGER PRIMARY KEY AUTOINCREMENT,
                         lender_id    TEXT NOT NULL,
-                        rate_30yr    NUMERIC(5,2) NOT NULL,
-                        rate_15yr    NUMERIC(5,2) NOT NULL,
-                        rate_arm_5_1 NUMERIC(5,2) NOT NULL,
-                        apr_30yr     NUMERIC(5,2) NOT NULL,
-                        recorded_at  TIMESTAMPTZ NOT NULL
+                        rate_30yr    REAL NOT NULL,
+                        rate_15yr    REAL NOT NULL,
+                        rate_arm_5_1 REAL NOT NULL,
+                        apr_30yr     REAL NOT NULL,
+                        recorded_at  TEXT NOT NULL
                     );
-                    CREATE INDEX IF NOT EXISTS idx_history_lender
-                        ON rate_history (lender_id, recorded_at DESC);
+                    CREATE INDEX IF NOT EXISTS idx_rates_30yr
+                        ON rates (rate_30yr, lender_id, lender_name, rate_15yr, rate_arm_5_1,
+                                  apr_30yr, min_credit, min_down_pct, updated_at);
+                    CREATE INDEX IF NOT EXISTS idx_history_lender_cover
+                        ON rate_history (lender_id, recorded_at DESC,
+                                         rate_30yr, rate_15yr, rate_arm_5_1, apr_30yr);
+                    DROP INDEX IF EXISTS idx_history_lender;
                     CREATE INDEX IF NOT EXISTS idx_history_date
                         ON rate_history (recorded_at DESC);
+                    CREATE UNIQUE INDEX IF NOT EXISTS uq_history_day
+                        ON rate_history (lender_id, date(recorded_at));
+                    CREATE TABLE IF NOT EXISTS history_stats (
+                        id           INTEGER PRIMARY KEY CHECK (id = 1),
+                        total_rows   INTEGER NOT NULL,
+                        lender_count INTEGER NOT NULL,
+                        days_covered INTEGER NOT NULL,
+                        earliest     TEXT,
+                        latest       TEXT
+                    );
+                """)
+            if conn.execute("SELECT 1 FROM history_stats").fetchone() is None:
+                # One-time backfill; upsert_rates keeps it current afterwards
+                conn.execute("""
+                    INSERT INTO history_stats
+                        (id, total_rows, lender_count, days_covered, earliest, latest)
+                    SELECT 1,
+                           COUNT(*),
+                           COUNT(DISTINCT lender_id),
+                           COUNT(DISTINCT date(recorded_at)),
+                           MIN(recorded_at),
+                           MAX(recorded_at)
+                    FROM rate_history
                 """)
-            conn.commit()
-    else:
-        with _sqlite_conn() as conn:
-            conn.executescript("""
-                CREATE TABLE IF NOT EXISTS rates (
-                    lender_id    TEXT PRIMARY KEY,
-                    lender_name  TEXT NOT NULL,
-                    rate_30yr    REAL NOT NULL,
-                    rate_15yr    REAL NOT NULL,
-                    rate_arm_5_1 REAL NOT NULL,
-                    apr_30yr     REAL NOT NULL,
-                    min_credit   INTEGER NOT NULL,
-                    min_down_pct REAL NOT NULL,
-                    updated_at   TEXT NOT NULL
-                );
-                CREATE TABLE IF NOT EXISTS rate_history (
-                    id           INTEGER PRIMARY KEY AUTOINCREMENT,
-                    lender_id    TEXT NOT NULL,
-                    rate_30yr    REAL NOT NULL,
-                    rate_15yr    REAL NOT NULL,
-                    rate_arm_5_1 REAL NOT NULL,
-                    apr_30yr     REAL NOT NULL,
-                    recorded_at  TEXT NOT NULL
-                );
-                CREATE INDEX IF NOT EXISTS idx_history_lender
-                    ON rate_history (lender_id, recorded_at DESC);
-                CREATE INDEX IF NOT EXISTS idx_history_date
-                    ON rate_history (recorded_at DESC);
-            """)
     print(f"[DB] Initialized ({'PostgreSQL' if _USE_POSTGRES else 'SQLite'})")
 
 
@@ -120,74 +325,96 @@ def upsert_rates(rate_list: list[dict]):
     Upsert latest snapshot AND append to history once per day per lender.
     Prevents duplicate history rows on service restarts.
     """
+    global _lender_names
     now = datetime.now(timezone.utc).isoformat()
+    for r in rate_list:
+        r["updated_at"] = now
 
     if _USE_POSTGRES:
         with _pg_conn() as conn:
             with conn.cursor() as cur:
-                for r in rate_list:
-                    r["updated_at"] = now
-                    cur.execute("""
-                        INSERT INTO rates
-                            (lender_id, lender_name, rate_30yr, rate_15yr, rate_arm_5_1,
-                             apr_30yr, min_credit, min_down_pct, updated_at)
-                        VALUES
-                            (%(lender_id)s, %(lender_name)s, %(rate_30yr)s, %(rate_15yr)s,
-                             %(rate_arm_5_1)s, %(apr_30yr)s, %(min_credit)s,
-                             %(min_down_pct)s, %(updated_at)s)
-                        ON CONFLICT (lender_id) DO UPDATE SET
-                            rate_30yr    = EXCLUDED.rate_30yr,
-                            rate_15yr    = EXCLUDED.rate_15yr,
-                            rate_arm_5_1 = EXCLUDED.rate_arm_5_1,
-                            apr_30yr     = EXCLUDED.apr_30yr,
-                            min_credit   = EXCLUDED.min_credit,
-                            min_down_pct = EXCLUDED.min_down_pct,
-                            updated_at   = EXCLUDED.updated_at
-                    """, r)
-                    # Append to history only once per calendar day per lender
-                    cur.execute("""
-                        INSERT INTO rate_history
-                            (lender_id, rate_30yr, rate_15yr, rate_arm_5_1, apr_30yr, recorded_at)
-                        SELECT %(lender_id)s, %(rate_30yr)s, %(rate_15yr)s,
-                               %(rate_arm_5_1)s, %(apr_30yr)s, %(updated_at)s
-                        WHERE NOT EXISTS (
-                            SELECT 1 FROM rate_history
-                            WHERE lender_id = %(lender_id)s
-                              AND recorded_at::date = %(updated_at)s::date
-                        )
-                    """, r)
-            conn.commit()
-    else:
-        with _sqlite_conn() as conn:
-            for r in rate_list:
-                r["updated_at"] = now
-                conn.execute("""
+                psycopg2.extras.execute_values(cur, """
                     INSERT INTO rates
                         (lender_id, lender_name, rate_30yr, rate_15yr, rate_arm_5_1,
                          apr_30yr, min_credit, min_down_pct, updated_at)
-                    VALUES
-                        (:lender_id, :lender_name, :rate_30yr, :rate_15yr, :rate_arm_5_1,
-                         :apr_30yr, :min_credit, :min_down_pct, :updated_at)
-                    ON CONFLICT(lender_id) DO UPDATE SET
-                        rate_30yr    = excluded.rate_30yr,
-                        rate_15yr    = excluded.rate_15yr,
-                        rate_arm_5_1 = excluded.rate_arm_5_1,
-                        apr_30yr     = excluded.apr_30yr,
-                        min_credit   = excluded.min_credit,
-                        min_down_pct = excluded.min_down_pct,
-                        updated_at   = excluded.updated_at
-                """, r)
-                conn.execute("""
+                    VALUES %s
+                    ON CONFLICT (lender_id) DO UPDATE SET
+                        rate_30yr    = EXCLUDED.rate_30yr,
+                        rate_15yr    = EXCLUDED.rate_15yr,
+                        rate_arm_5_1 = EXCLUDED.rate_arm_5_1,
+                        apr_30yr     = EXCLUDED.apr_30yr,
+                        min_credit   = EXCLUDED.min_credit,
+                        min_down_pct = EXCLUDED.min_down_pct,
+                        updated_at   = EXCLUDED.updated_at
+                """, rate_list, template="""
+                    (%(lender_id)s, %(lender_name)s, %(rate_30yr)s, %(rate_15yr)s,
+                     %(rate_arm_5_1)s, %(apr_30yr)s, %(min_credit)s,
+                     %(min_down_pct)s, %(updated_at)s)
+                """)
+                # Append to history only once per calendar day per lender
+                # (uq_history_day rejects the rest)
+                inserted = psycopg2.extras.execute_values(cur, """
                     INSERT INTO rate_history
                         (lender_id, rate_30yr, rate_15yr, rate_arm_5_1, apr_30yr, recorded_at)
-                    SELECT :lender_id, :rate_30yr, :rate_15yr, :rate_arm_5_1, :apr_30yr, :updated_at
-                    WHERE NOT EXISTS (
-                        SELECT 1 FROM rate_history
-                        WHERE lender_id = :lender_id
-                          AND date(recorded_at) = date(:updated_at)
-                    )
-                """, r)
+                    VALUES %s
+                    ON CONFLICT DO NOTHING
+                    RETURNING 1
+                """, rate_list, template="""
+                    (%(lender_id)s, %(rate_30yr)s, %(rate_15yr)s,
+                     %(rate_arm_5_1)s, %(apr_30yr)s, %(updated_at)s)
+                """, fetch=True)
+                if inserted:
+                    cur.execute("""
+                        UPDATE history_stats SET
+                            total_rows   = total_rows + %(n)s,
+                            lender_count = (SELECT COUNT(*) FROM rates),
+                            days_covered = days_covered + CASE
+                                WHEN latest IS NULL
+                                  OR (latest AT TIME ZONE 'UTC')::date
+                                   < (%(now)s::timestamptz AT TIME ZONE 'UTC')::date
+                                THEN 1 ELSE 0 END,
+                            earliest     = COALESCE(earliest, %(now)s),
+                            latest       = %(now)s
+                    """, {"n": len(inserted), "now": now})
+    else:
+        with _sqlite_conn(write=True) as conn:
+            conn.executemany("""
+                INSERT INTO rates
+                    (lender_id, lender_name, rate_30yr, rate_15yr, rate_arm_5_1,
+                     apr_30yr, min_credit, min_down_pct, updated_at)
+                VALUES
+                    (:lender_id, :lender_name, :rate_30yr, :rate_15yr, :rate_arm_5_1,
+                     :apr_30yr, :min_credit, :min_down_pct, :updated_at)
+                ON CONFLICT(lender_id) DO UPDATE SET
+                    rate_30yr    = excluded.rate_30yr,
+                    rate_15yr    = excluded.rate_15yr,
+                    rate_arm_5_1 = excluded.rate_arm_5_1,
+                    apr_30yr     = excluded.apr_30yr,
+                    min_credit   = excluded.min_credit,
+                    min_down_pct = excluded.min_down_pct,
+                    updated_at   = excluded.updated_at
+            """, rate_list)
+            inserted = conn.executemany("""
+                INSERT INTO rate_history
+                    (lender_id, rate_30yr, rate_15yr, rate_arm_5_1, apr_30yr, recorded_at)
+                VALUES
+                    (:lender_id, :rate_30yr, :rate_15yr, :rate_arm_5_1, :apr_30yr, :updated_at)
+                ON CONFLICT DO NOTHING
+            """, rate_list).rowcount
+            if inserted > 0:
+                conn.execute("""
+                    UPDATE history_stats SET
+                        total_rows   = total_rows + :n,
+                        lender_count = (SELECT COUNT(*) FROM rates),
+                        days_covered = days_covered
+                                       + (latest IS NULL OR date(latest) < date(:now)),
+                        earliest     = COALESCE(earliest, :now),
+                        latest       = :now
+                """, {"n": inserted, "now": now})
 
+    # Cached API reads are stale as soon as the new snapshot is committed
+    _lender_names = {}
+    cache.invalidate("rates:v2", "stats:v2", "version:v2", "history:*", "lender:*")
     print(f"[DB] Upserted {len(rate_list)} lender rates at {now}")
 
 
@@ -198,13 +425,58 @@ def get_all_rates() -> list[dict]:
     if _USE_POSTGRES:
         with _pg_conn() as conn:
             with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-                cur.execute("SELECT * FROM rates ORDER BY rate_30yr ASC")
+                cur.execute("""
+                    SELECT lender_id, lender_name, rate_30yr, rate_15yr, rate_arm_5_1,
+                           apr_30yr, min_credit, min_down_pct,
+                           to_char(updated_at AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"') AS updated_at
+                    FROM rates ORDER BY rate_30yr ASC
+                """)
                 return [dict(r) for r in cur.fetchall()]
     else:
         with _sqlite_conn() as conn:
-            return [dict(r) for r in conn.execute(
-                "SELECT * FROM rates ORDER BY rate_30yr ASC"
-            ).fetchall()]
+            return [dict(r) for r in conn.execute("""
+                SELECT lender_id, lender_name, rate_30yr, rate_15yr, rate_arm_5_1,
+                       apr_30yr, min_credit, min_down_pct, updated_at
+                FROM rates ORDER BY rate_30yr ASC
+            """).fetchall()]
+
+
+def has_recent_rates(max_age_hours: int = 24) -> bool:
+    """True if the rates snapshot was refreshed within the last max_age_hours."""
+    if _USE_POSTGRES:
+        with _pg_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT 1 FROM rates
+                    WHERE updated_at >= NOW() - (%s || ' hours')::INTERVAL
+                    LIMIT 1
+                """, (str(max_age_hours),))
+                return cur.fetchone() is not None
+    else:
+        # updated_at is ISO-8601 ("...T...+00:00"); normalise it with datetime()
+        # so it compares as a time, not as text against "YYYY-MM-DD HH:MM:SS".
+        with _sqlite_conn() as conn:
+            return conn.execute("""
+                SELECT 1 FROM rates
+                WHERE datetime(updated_at) >= datetime('now', ? || ' hours')
+                LIMIT 1
+            """, (f"-{max_age_hours}",)).fetchone() is not None
+
+
+def get_last_updated() -> str | None:
+    """Timestamp of the latest snapshot (full precision) — the data version."""
+    if _USE_POSTGRES:
+        with _pg_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT to_char(MAX(updated_at) AT TIME ZONE 'UTC',
+                                   'YYYY-MM-DD"T"HH24:MI:SS.US"Z"')
+                    FROM rates
+                """)
+                return cur.fetchone()[0]
+    else:
+        with _sqlite_conn() as conn:
+            return conn.execute("SELECT MAX(updated_at) FROM rates").fetchone()[0]
 
 
 def get_rate_history(lender_id: str, days: int = 90) -> list[dict]:
@@ -213,46 +485,134 @@ def get_rate_history(lender_id: str, days: int = 90) -> list[dict]:
         with _pg_conn() as conn:
             with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
                 cur.execute("""
-                    SELECT * FROM rate_history
+                    SELECT lender_id, rate_30yr, rate_15yr, rate_arm_5_1, apr_30yr,
+                           to_char(recorded_at AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"') AS recorded_at
+                    FROM rate_history
                     WHERE lender_id = %s
-                    ORDER BY recorded_at DESC LIMIT %s
+                    ORDER BY rate_history.recorded_at DESC LIMIT %s
                 """, (lender_id, days))
                 return [dict(r) for r in cur.fetchall()]
     else:
         with _sqlite_conn() as conn:
             return [dict(r) for r in conn.execute("""
-                SELECT * FROM rate_history
+                SELECT lender_id, rate_30yr, rate_15yr, rate_arm_5_1, apr_30yr, recorded_at
+                FROM rate_history
                 WHERE lender_id = ?
                 ORDER BY recorded_at DESC LIMIT ?
             """, (lender_id, days)).fetchall()]
 
 
+# lender_id → lender_name, loaded from `rates` on first use and dropped by
+# upsert_rates. History reads attach names from here instead of joining.
+_lender_names: dict[str, str] = {}
+
+
+def _load_lender_names(conn) -> dict[str, str]:
+    global _lender_names
+    if _USE_POSTGRES:
+        with conn.cursor() as cur:
+            cur.execute("SELECT lender_id, lender_name FROM rates")
+            _lender_names = dict(cur.fetchall())
+    else:
+        _lender_names = {r[0]: r[1] for r in conn.execute(
+            "SELECT lender_id, lender_name FROM rates"
+        )}
+    return _lender_names
+
+
+def _attach_lender_names(conn, rows):
+    """Fill in lender_name; reloads the map once if a lender is missing."""
+    names = _lender_names or _load_lender_names(conn)
+    reloaded = False
+    for r in rows:
+        name = names.get(r["lender_id"])
+        if name is None and not reloaded:
+            # Possibly a lender added by another worker since we loaded
+            names, reloaded = _load_lender_names(conn), True
+            name = names.get(r["lender_id"])
+        if name is None:
+            continue  # no snapshot row — the old inner JOIN skipped these too
+        r["lender_name"] = name
+        yield r
+
+
+def _sqlite_cutoff(days: int) -> str:
+    # Same ISO-8601 form as the stored recorded_at, so the text comparison is
+    # a time comparison and idx_history_date still serves the range.
+    return (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+
+
 def get_all_history(days: int = 365) -> list[dict]:
     """Full history for ALL lenders for the past N days, newest first."""
     if _USE_POSTGRES:
         with _pg_conn() as conn:
             with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
                 cur.execute("""
-                    SELECT h.id, h.lender_id, r.lender_name,
-                           h.rate_30yr, h.rate_15yr, h.rate_arm_5_1, h.apr_30yr,
-                           h.recorded_at
-                    FROM rate_history h
-                    JOIN rates r USING (lender_id)
-                    WHERE h.recorded_at >= NOW() - (%s || ' days')::INTERVAL
-                    ORDER BY h.recorded_at DESC, h.lender_id
+                    SELECT id, lender_id, rate_30yr, rate_15yr, rate_arm_5_1, apr_30yr,
+                           to_char(recorded_at AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"') AS recorded_at
+                    FROM rate_history
+                    WHERE recorded_at >= NOW() - (%s || ' days')::INTERVAL
+                    ORDER BY rate_history.recorded_at DESC, lender_id
                 """, (str(days),))
-                return [dict(r) for r in cur.fetchall()]
+                rows = [dict(r) for r in cur.fetchall()]
+            return list(_attach_lender_names(conn, rows))
     else:
         with _sqlite_conn() as conn:
-            return [dict(r) for r in conn.execute("""
-                SELECT h.id, h.lender_id, r.lender_name,
-                       h.rate_30yr, h.rate_15yr, h.rate_arm_5_1, h.apr_30yr,
-                       h.recorded_at
-                FROM rate_history h
-                JOIN rates r USING (lender_id)
-                WHERE h.recorded_at >= datetime('now', ? || ' days')
-                ORDER BY h.recorded_at DESC, h.lender_id
-            """, (f"-{days}",)).fetchall()]
+            rows = [dict(r) for r in conn.execute("""
+                SELECT id, lender_id, rate_30yr, rate_15yr, rate_arm_5_1, apr_30yr,
+                       recorded_at
+                FROM rate_history
+                WHERE recorded_at >= ?
+                ORDER BY recorded_at DESC, lender_id
+            """, (_sqlite_cutoff(days),)).fetchall()]
+            return list(_attach_lender_names(conn, rows))
+
+
+HISTORY_COLUMNS = ["recorded_at", "lender_id", "rate_30yr", "rate_15yr", "rate_arm_5_1", "apr_30yr"]
+
+
+def history_to_columns(rows: list[dict]) -> dict:
+    """
+    History rows (as from get_all_history) in columnar form: one list per
+    column (same row order) plus a lender_id → lender_name map, so key names
+    and lender names are sent once instead of once per row.
+    """
+    return {
+        "columns": HISTORY_COLUMNS,
+        "data":    {c: [r[c] for r in rows] for c in HISTORY_COLUMNS},
+        "lenders": {r["lender_id"]: r["lender_name"] for r in rows},
+    }
+
+
+def stream_all_history(days: int = 365):
+    """
+    Same rows as get_all_history, yielded one at a time.
+    Postgres uses a named (server-side) cursor so the result set is pulled
+    STREAM_ITERSIZE rows at a time instead of being buffered in memory —
+    used by the CSV export.
+    """
+    if _USE_POSTGRES:
+        with _pg_conn() as conn:
+            with conn.cursor(name=f"hist_{uuid4().hex}", withhold=False,
+                             cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                cur.itersize = STREAM_ITERSIZE
+                cur.execute("""
+                    SELECT id, lender_id, rate_30yr, rate_15yr, rate_arm_5_1, apr_30yr,
+                           to_char(recorded_at AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"') AS recorded_at
+                    FROM rate_history
+                    WHERE recorded_at >= NOW() - (%s || ' days')::INTERVAL
+                    ORDER BY rate_history.recorded_at DESC, lender_id
+                """, (str(days),))
+                yield from _attach_lender_names(conn, (dict(r) for r in cur))
+    else:
+        with _sqlite_conn() as conn:
+            yield from _attach_lender_names(conn, (dict(r) for r in conn.execute("""
+                SELECT id, lender_id, rate_30yr, rate_15yr, rate_arm_5_1, apr_30yr,
+                       recorded_at
+                FROM rate_history
+                WHERE recorded_at >= ?
+                ORDER BY recorded_at DESC, lender_id
+            """, (_sqlite_cutoff(days),))))
 
 
 def get_history_stats() -> dict:
@@ -261,21 +621,15 @@ def get_history_stats() -> dict:
         with _pg_conn() as conn:
             with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
                 cur.execute("""
-                    SELECT COUNT(*)                          AS total_rows,
-                           COUNT(DISTINCT lender_id)         AS lender_count,
-                           COUNT(DISTINCT recorded_at::date) AS days_covered,
-                           MIN(recorded_at)                  AS earliest,
-                           MAX(recorded_at)                  AS latest
-                    FROM rate_history
+                    SELECT total_rows, lender_count, days_covered,
+                           to_char(earliest AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"') AS earliest,
+                           to_char(latest AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"') AS latest
+                    FROM history_stats
                 """)
                 return dict(cur.fetchone())
     else:
         with _sqlite_conn() as conn:
             return dict(conn.execute("""
-                SELECT COUNT(*)                           AS total_rows,
-                       COUNT(DISTINCT lender_id)          AS lender_count,
-                       COUNT(DISTINCT date(recorded_at))  AS days_covered,
-                       MIN(recorded_at)                   AS earliest,
-                       MAX(recorded_at)                   AS latest
-                FROM rate_history
+                SELECT total_rows, lender_count, days_covered, earliest, latest
+                FROM history_stats
             """).fetchone())
@@ -0,0 +1,172 @@
+"""
+exports.py — CSV export of rate history, streamed or built in the background.
+
+Two ways to get the same CSV:
+  • iter_csv(days)     → byte chunks for a StreamingResponse (/api/export.csv)
+  • start_export(days) → writes <EXPORT_DIR>/<job_id>.csv.gz on a small
+                         worker pool, so long exports don't hold a request
+                         open (/api/export/jobs)
+
+Job ids are derived from the requested range and the current data version,
+so repeated requests for the same export share one file, and any worker
+that can see EXPORT_DIR can report on it: <job_id>.csv.gz when done, a
+<job_id>.<pid>-<tid>.tmp being written while running, <job_id>.failed after
+an error. A .tmp not written to for EXPORT_STALE_TMP seconds belongs to a
+writer that died; it is ignored and pruned.
+"""
+
+import io
+import os
+import csv
+import gzip
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from operator import itemgetter
+from pathlib import Path
+
+from database import stream_all_history, get_history_stats
+
+EXPORT_DIR = Path(os.getenv("EXPORT_DIR", "exports"))
+EXPORT_MAX_AGE = int(os.getenv("EXPORT_MAX_AGE_HOURS", "48")) * 3600
+EXPORT_STALE_TMP = int(os.getenv("EXPORT_STALE_TMP_SECONDS", "600"))
+
+# Background exports run on a small fixed pool; at most EXPORT_MAX_PENDING
+# jobs (queued + running) are accepted at once, further requests are refused.
+EXPORT_WORKERS     = int(os.getenv("EXPORT_WORKERS", "2"))
+EXPORT_MAX_PENDING = int(os.getenv("EXPORT_MAX_PENDING", "4"))
+
+CSV_FIELDS = [
+    "recorded_at", "lender_id", "lender_name",
+    "rate_30yr", "rate_15yr", "rate_arm_5_1", "apr_30yr",
+]
+# Pulls the CSV columns out of a history row in one C-level call
+_csv_row = itemgetter(*CSV_FIELDS)
+
+# Rows per streamed chunk — one ASGI body message per chunk, not per row
+CSV_CHUNK_ROWS = 500
+
+_running: set[str] = set()
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="export")
+
+
+# ── CSV generation ───────────────────────────────────────────────────────────
+
+def iter_csv(days: int):
+    """Yield the history CSV as UTF-8 byte chunks of CSV_CHUNK_ROWS rows."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(CSV_FIELDS)
+    for i, r in enumerate(stream_all_history(days=days), 1):
+        writer.writerow(_csv_row(r))
+        if i % CSV_CHUNK_ROWS == 0:
+            yield buf.getvalue().encode()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode()
+
+
+# ── Background jobs ──────────────────────────────────────────────────────────
+
+def _job_path(job_id: str) -> Path:
+    return EXPORT_DIR / f"{job_id}.csv.gz"
+
+
+def _job_id(days: int) -> str:
+    """Same id while the data (and the day the window is anchored to) is unchanged."""
+    stats = get_history_stats()
+    today = datetime.now(timezone.utc).date().isoformat()
+    key = f"{days}|{today}|{stats['total_rows']}|{stats['latest']}"
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def _failed_path(job_id: str) -> Path:
+    return EXPORT_DIR / f"{job_id}.failed"
+
+
+def _live_tmp(job_id: str) -> bool:
+    """True if some worker (any process) is still writing this job."""
+    cutoff = time.time() - EXPORT_STALE_TMP
+    for p in EXPORT_DIR.glob(f"{job_id}.*.tmp"):
+        try:
+            if p.stat().st_mtime >= cutoff:
+                return True
+        except OSError:
+            pass
+    return False
+
+
+def _prune():
+    now = time.time()
+    for pattern, max_age in (("*.csv.gz", EXPORT_MAX_AGE),
+                             ("*.failed", EXPORT_MAX_AGE),
+                             ("*.tmp",    EXPORT_STALE_TMP)):
+        for p in EXPORT_DIR.glob(pattern):
+            try:
+                if p.stat().st_mtime < now - max_age:
+                    p.unlink()
+            except OSError:
+                pass
+
+
+def _run_export(job_id: str, days: int):
+    # Unique temp name per writer; os.replace makes the finished file appear
+    # atomically even if two workers build the same export.
+    tmp = EXPORT_DIR / f"{job_id}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        with gzip.open(tmp, "wb", compresslevel=6) as f:
+            for chunk in iter_csv(days):
+                f.write(chunk)
+        os.replace(tmp, _job_path(job_id))
+        print(f"[Export] Job {job_id} finished ({days} days)")
+    except Exception as e:
+        print(f"[Export] Job {job_id} failed: {e}")
+        try:
+            _failed_path(job_id).write_text(str(e))
+        except OSError:
+            pass
+        tmp.unlink(missing_ok=True)
+    finally:
+        with _lock:
+            _running.discard(job_id)
+
+
+def start_export(days: int) -> str | None:
+    """
+    Start (or reuse) the background export for `days`; returns its job id,
+    or None if EXPORT_MAX_PENDING jobs are already queued or running.
+    """
+    EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+    _prune()
+    job_id = _job_id(days)
+    with _lock:
+        if job_id in _running or _job_path(job_id).exists():
+            return job_id
+        if len(_running) >= EXPORT_MAX_PENDING:
+            return None
+        _failed_path(job_id).unlink(missing_ok=True)  # resubmitting retries it
+        _running.add(job_id)
+    _executor.submit(_run_export, job_id, days)
+    return job_id
+
+
+def export_status(job_id: str) -> str | None:
+    """'done', 'running', 'failed', or None if the job is unknown."""
+    if _job_path(job_id).exists():
+        return "done"
+    with _lock:
+        if job_id in _running:
+            return "running"
+    if _live_tmp(job_id):  # started by another worker process
+        return "running"
+    if _failed_path(job_id).exists():
+        return "failed"
+    return None
+
+
+def export_file(job_id: str) -> Path | None:
+    path = _job_path(job_id)
+    return path if path.exists() else None
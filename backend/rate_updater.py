@@ -14,18 +14,48 @@ a per-lender spread that reflects their historical pricing position.
 
 import os
 import json
+import asyncio
+import logging
 import random
+import socket
 import sqlite3
-from datetime import datetime, timezone
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
 from pathlib import Path
+from urllib.parse import urlsplit
+from urllib.request import getproxies
+from zoneinfo import ZoneInfo
+
+# Optional: faster JSON for FRED responses and the state/cache files (stdlib fallback)
+try:
+    import orjson
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+except ImportError:
+    _json_loads = json.loads
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+
+try:
+    import fcntl
+except ImportError:  # Windows — cache file access is then unlocked
+    fcntl = None
 
 # Optional: pip install requests
 try:
     import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.exceptions import ReadTimeoutError
+    from urllib3.util.retry import Retry
     HAS_REQUESTS = True
 except ImportError:
     HAS_REQUESTS = False
 
+log = logging.getLogger(__name__)
+
 # ── FRED API (free, no key required for basic series) ───────────────────────
 FRED_BASE = "https://api.stlouisfed.org/fred/series/observations"
 FRED_API_KEY = os.getenv("FRED_API_KEY", "")  # optional but increases rate limit
@@ -35,8 +65,62 @@ SERIES_30YR = "MORTGAGE30US"   # Freddie Mac 30-yr fixed, weekly
 SERIES_15YR = "MORTGAGE15US"   # Freddie Mac 15-yr fixed, weekly
 SERIES_ARM  = "MORTGAGE5US"    # 5/1 ARM, weekly
 
+# Query params per series, built once. Without a key FRED still works
+# (public demo key) but has lower rate limits.
+_BASE_PARAMS = {
+    "sort_order":   "desc",
+    "limit":        1,
+    "file_type":    "json",
+    "api_key":      FRED_API_KEY or "abcdefghijklmnopqrstuvwxyz012345",
+}
+_FRED_PARAMS = {s: {**_BASE_PARAMS, "series_id": s}
+                for s in (SERIES_30YR, SERIES_15YR, SERIES_ARM)}
+
+# Timeouts in seconds. After a read timeout the next call waits longer
+# (FRED_SLOW_READ_TIMEOUT) instead of failing the same way again.
+FRED_CONNECT_TIMEOUT   = 3
+FRED_READ_TIMEOUT      = 7
+FRED_SLOW_READ_TIMEOUT = 15
+_fred_last_slow = False
+
+# Quick TCP probe of the FRED host before the HTTP calls, so offline
+# deployments fall back to simulation immediately. Result reused for 60s.
+FRED_PROBE_TIMEOUT = 0.5
+FRED_PROBE_TTL     = 60
+_FRED_PROBE: tuple[float, bool] | None = None   # (monotonic time, reachable)
+
+# Circuit breaker: after FRED_BREAKER_THRESHOLD consecutive failed attempts,
+# skip FRED entirely for FRED_BREAKER_COOLDOWN seconds.
+FRED_BREAKER_THRESHOLD = 3
+FRED_BREAKER_COOLDOWN  = 600
+_FRED_BREAKER = {"fails": 0, "open_until": 0.0}
+
+# One keep-alive session for all FRED calls (shared by the fetch threads),
+# with up to 2 retries + exponential backoff (0.5s, 1s) on connection errors,
+# throttling and transient server errors.
+if HAS_REQUESTS:
+    _SESSION = requests.Session()
+    _SESSION.mount("https://", HTTPAdapter(
+        pool_maxsize=3,
+        max_retries=Retry(total=2, backoff_factor=0.5,
+                          status_forcelist=[429, 500, 502, 503, 504],
+                          allowed_methods=["GET"]),
+    ))
+
 # State file to persist last known good rates between runs
 STATE_FILE = Path(os.getenv("RATE_STATE_FILE", "last_rates.json"))
+# In-memory copy of STATE_FILE, valid while its mtime is unchanged
+_STATE_CACHE: dict | None = None
+_STATE_MTIME: int | None = None
+
+# FRED values cached on disk until the next weekly PMMS release
+# (Thursdays ~noon ET), so daily runs and manual refreshes don't re-hit FRED.
+FRED_CACHE_FILE = Path(os.getenv("FRED_CACHE_FILE",
+                                 STATE_FILE.with_name("fred_cache.json")))
+# An observation older than the latest expected release (FRED hasn't posted
+# it yet, or a holiday moved it) is only cached this long before retrying.
+FRED_STALE_CACHE_TTL = 3600
+_ET = ZoneInfo("America/New_York")
 
 # ── Per-lender spread table (basis points above/below market) ───────────────
 # Positive = lender charges more than market; negative = lender undercuts market
@@ -73,104 +157,264 @@ LENDER_SPREADS = {
 # APR is typically rate + ~0.20–0.35% depending on fees
 APR_SPREAD = 0.24
 
+# Static per-lender fields built once at import, in LENDER_SPREADS order.
+# Rate keys are placeholders so copies keep the output key order.
+_LENDER_TEMPLATES = [
+    {
+        "lender_id":    lender_id,
+        "lender_name":  info["name"],
+        "rate_30yr":    None,
+        "rate_15yr":    None,
+        "rate_arm_5_1": None,
+        "apr_30yr":     None,
+        "min_credit":   info["min_credit"],
+        "min_down_pct": info["min_down"],
+    }
+    for lender_id, info in LENDER_SPREADS.items()
+]
+_SPREAD_30   = tuple(v["spread_30"]  for v in LENDER_SPREADS.values())
+_SPREAD_15   = tuple(v["spread_15"]  for v in LENDER_SPREADS.values())
+_SPREAD_ARM  = tuple(v["spread_arm"] for v in LENDER_SPREADS.values())
+
 
 # ── Helpers ─────────────────────────────────────────────────────────────────
 
 def _round2(v: float) -> float:
-    return round(v, 2)
+    # Half-away-from-zero via integer scaling; cheaper than round(v, 2)
+    return int(v * 100 + (0.5 if v >= 0 else -0.5)) / 100
 
 
 def _load_state() -> dict:
-    if STATE_FILE.exists():
+    global _STATE_CACHE, _STATE_MTIME
+    try:
+        mtime = STATE_FILE.stat().st_mtime_ns
+    except OSError:
+        mtime = None
+    if mtime is not None:
+        # Skip the read + parse unless the file changed since we last saw it
+        if _STATE_CACHE is not None and mtime == _STATE_MTIME:
+            return dict(_STATE_CACHE)
         try:
-            return json.loads(STATE_FILE.read_text())
+            state = _json_loads(STATE_FILE.read_bytes())
+            _STATE_CACHE, _STATE_MTIME = state, mtime
+            return dict(state)
         except Exception:
             pass
     # Bootstrap defaults
     return {"rate_30yr": 6.74, "rate_15yr": 6.05, "rate_arm": 5.98}
 
 
+def _write_atomic(path: Path, data: bytes):
+    """Write via a temp file + os.replace so readers never see a partial file."""
+    tmp = path.with_name(f"{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
 def _save_state(state: dict):
-    STATE_FILE.write_text(json.dumps(state, indent=2))
+    global _STATE_CACHE, _STATE_MTIME
+    _write_atomic(STATE_FILE, _json_dumps(state))
+    _STATE_CACHE, _STATE_MTIME = dict(state), STATE_FILE.stat().st_mtime_ns
 
 
 def _build_lender_rates(base_30: float, base_15: float, base_arm: float) -> list[dict]:
     """Apply per-lender spreads to the market base rates."""
     result = []
-    for lender_id, info in LENDER_SPREADS.items():
-        r30  = _round2(base_30  + info["spread_30"])
-        r15  = _round2(base_15  + info["spread_15"])
-        rarm = _round2(base_arm + info["spread_arm"])
-        result.append({
-            "lender_id":    lender_id,
-            "lender_name":  info["name"],
-            "rate_30yr":    r30,
-            "rate_15yr":    r15,
-            "rate_arm_5_1": rarm,
-            "apr_30yr":     _round2(r30 + APR_SPREAD),
-            "min_credit":   info["min_credit"],
-            "min_down_pct": info["min_down"],
-        })
+    for tmpl, s30, s15, sarm in zip(_LENDER_TEMPLATES, _SPREAD_30, _SPREAD_15, _SPREAD_ARM):
+        r30 = _round2(base_30 + s30)
+        row = tmpl.copy()
+        row["rate_30yr"]    = r30
+        row["rate_15yr"]    = _round2(base_15  + s15)
+        row["rate_arm_5_1"] = _round2(base_arm + sarm)
+        row["apr_30yr"]     = _round2(r30 + APR_SPREAD)
+        result.append(row)
     return result
 
 
 # ── Source 1: FRED API ───────────────────────────────────────────────────────
 
-def _fetch_fred_series(series_id: str) -> float | None:
-    """Fetch the most recent observation from the FRED API."""
-    if not HAS_REQUESTS:
-        return None
-    params = {
-        "series_id":    series_id,
-        "sort_order":   "desc",
-        "limit":        1,
-        "file_type":    "json",
-    }
-    if FRED_API_KEY:
-        params["api_key"] = FRED_API_KEY
-    else:
-        # Without a key FRED still works but has lower rate limits
-        params["api_key"] = "abcdefghijklmnopqrstuvwxyz012345"  # public demo key
+def _next_release(now: datetime) -> datetime:
+    """Next Thursday 13:00 ET strictly after `now`."""
+    now_et = now.astimezone(_ET)
+    release = (now_et + timedelta(days=(3 - now_et.weekday()) % 7)).replace(
+        hour=13, minute=0, second=0, microsecond=0)
+    if release <= now_et:
+        release += timedelta(days=7)
+    return release
 
+
+@contextmanager
+def _fred_cache_lock(exclusive: bool):
+    """flock on a sidecar file — serialises cache access across threads/processes."""
+    with open(FRED_CACHE_FILE.with_suffix(".lock"), "a") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield  # closing the file releases the lock
+
+
+def _read_fred_cache() -> dict:
     try:
-        resp = requests.get(FRED_BASE, params=params, timeout=10)
+        return _json_loads(FRED_CACHE_FILE.read_bytes())
+    except (OSError, ValueError):
+        return {}
+
+
+def _fred_cache_get(series: tuple[str, ...]) -> dict[str, float]:
+    """Unexpired cached values for `series` — one locked read for all of them."""
+    try:
+        with _fred_cache_lock(exclusive=False):
+            cache = _read_fred_cache()
+    except OSError:
+        return {}
+    now = datetime.now(timezone.utc)
+    return {sid: cache[sid]["value"] for sid in series
+            if sid in cache and datetime.fromisoformat(cache[sid]["ttl_until"]) > now}
+
+
+def _fred_cache_ttl(obs_date: str, now: datetime) -> datetime:
+    next_release = _next_release(now)
+    # Current if dated after the release before the latest one — allows for
+    # holiday weeks when PMMS comes out a day or two early.
+    if date.fromisoformat(obs_date) > (next_release - timedelta(days=14)).date():
+        return next_release
+    return now + timedelta(seconds=FRED_STALE_CACHE_TTL)
+
+
+def _fred_cache_put(values: dict[str, tuple[float, str]]):
+    """Store {series_id: (value, observation date)} — one locked write."""
+    now = datetime.now(timezone.utc)
+    try:
+        with _fred_cache_lock(exclusive=True):
+            cache = _read_fred_cache()
+            for sid, (v, obs_date) in values.items():
+                cache[sid] = {"value": v, "date": obs_date, "fetched_at": now.isoformat(),
+                              "ttl_until": _fred_cache_ttl(obs_date, now).isoformat()}
+            _write_atomic(FRED_CACHE_FILE, _json_dumps(cache))
+    except OSError as e:
+        log.warning("[FRED] Could not write cache %s: %s", FRED_CACHE_FILE, e)
+
+
+def _fetch_fred_series(series_id: str) -> tuple[float, str] | None:
+    """Most recent (value, observation date) for series_id from the FRED API."""
+    global _fred_last_slow
+    read_timeout = FRED_SLOW_READ_TIMEOUT if _fred_last_slow else FRED_READ_TIMEOUT
+    try:
+        resp = _SESSION.get(FRED_BASE, params=_FRED_PARAMS[series_id],
+                            timeout=(FRED_CONNECT_TIMEOUT, read_timeout))
+        _fred_last_slow = False
         resp.raise_for_status()
-        obs = resp.json()["observations"]
+        obs = _json_loads(resp.content)["observations"]
         if obs and obs[0]["value"] != ".":
-            return float(obs[0]["value"])
+            return float(obs[0]["value"]), obs[0]["date"]
     except Exception as e:
-        print(f"[FRED] Failed to fetch {series_id}: {e}")
+        if _is_read_timeout(e):
+            _fred_last_slow = True
+        log.warning("[FRED] Failed to fetch %s: %s", series_id, e)
     return None
 
 
+def _is_read_timeout(exc: Exception) -> bool:
+    # Once retries are exhausted requests wraps the read timeout in a
+    # ConnectionError(MaxRetryError(reason=ReadTimeoutError)).
+    if isinstance(exc, requests.ReadTimeout):
+        return True
+    reason = getattr(exc.args[0], "reason", None) if exc.args else None
+    return isinstance(reason, ReadTimeoutError)
+
+
+def _fred_reachable() -> bool:
+    global _FRED_PROBE
+    now = time.monotonic()
+    if _FRED_PROBE and now - _FRED_PROBE[0] < FRED_PROBE_TTL:
+        return _FRED_PROBE[1]
+    if "https" in getproxies():
+        return True  # only the proxy is dialled directly — let requests decide
+    url = urlsplit(FRED_BASE)
+    try:
+        socket.create_connection((url.hostname, url.port or 443),
+                                 timeout=FRED_PROBE_TIMEOUT).close()
+        reachable = True
+    except OSError:
+        reachable = False
+    _FRED_PROBE = (now, reachable)
+    return reachable
+
+
+def _fred_failed():
+    _FRED_BREAKER["fails"] += 1
+    if _FRED_BREAKER["fails"] >= FRED_BREAKER_THRESHOLD:
+        _FRED_BREAKER["open_until"] = time.monotonic() + FRED_BREAKER_COOLDOWN
+        _FRED_BREAKER["fails"] = 0
+        log.warning("[FRED] %d failed attempts in a row — skipping FRED for %ds",
+                    FRED_BREAKER_THRESHOLD, FRED_BREAKER_COOLDOWN)
+
+
 def _try_fred() -> tuple[float, float, float] | None:
-    """Try to get all three base rates from FRED."""
-    r30  = _fetch_fred_series(SERIES_30YR)
-    r15  = _fetch_fred_series(SERIES_15YR)
-    rarm = _fetch_fred_series(SERIES_ARM)
-    if r30 and r15 and rarm:
-        print(f"[FRED] 30yr={r30}%  15yr={r15}%  ARM={rarm}%")
-        return r30, r15, rarm
-    return None
+    """Try to get all three base rates from FRED (fetched concurrently)."""
+    series = (SERIES_30YR, SERIES_15YR, SERIES_ARM)
+    values = _fred_cache_get(series)
+    missing = [s for s in series if s not in values]
+    if missing:
+        if time.monotonic() < _FRED_BREAKER["open_until"]:
+            log.info("[FRED] Circuit open after repeated failures — skipping")
+            return None
+        if not (HAS_REQUESTS and _fred_reachable()):
+            log.warning("[FRED] API unreachable — skipping")
+            _fred_failed()
+            return None
+        with ThreadPoolExecutor(max_workers=3, thread_name_prefix="fred") as pool:
+            fetched = {s: r for s, r in zip(missing, pool.map(_fetch_fred_series, missing))
+                       if r is not None}
+        if not fetched:
+            _fred_failed()
+            if not values:
+                return None
+        else:
+            _FRED_BREAKER["fails"] = 0
+            _fred_cache_put(fetched)
+            values.update((s, r[0]) for s, r in fetched.items())
+    r30, r15, rarm = (values.get(s) for s in series)
+    if r30 is None or r15 is None or rarm is None:
+        # Keep what FRED did return; fill the gaps with the last known rates
+        state = _load_state()
+        r30  = r30  if r30  is not None else state["rate_30yr"]
+        r15  = r15  if r15  is not None else state["rate_15yr"]
+        rarm = rarm if rarm is not None else state["rate_arm"]
+        log.warning("[FRED] Partial fetch — missing series carried over from last state")
+    log.info("[FRED] 30yr=%s%%  15yr=%s%%  ARM=%s%%", r30, r15, rarm)
+    return r30, r15, rarm
 
 
 # ── Source 2: Simulated random walk (fallback) ───────────────────────────────
 
+# (state key, share of the 30-yr move, floor, ceiling) per simulated rate
+_SIM_TERMS = (
+    ("rate_30yr", 1.00, 5.50, 8.50),
+    ("rate_15yr", 0.90, 5.00, 8.00),
+    ("rate_arm",  0.75, 4.75, 7.50),
+)
+
+
 def _simulate_rates() -> tuple[float, float, float]:
     """
     Apply a tiny random walk to yesterday's rates.
     Stays within realistic bounds for 2026.
     """
     state = _load_state()
-    delta_30  = random.gauss(0, 0.03)   # ~3bp daily std deviation
-    delta_15  = delta_30 * 0.90
-    delta_arm = delta_30 * 0.75
-
-    r30  = max(5.50, min(8.50, _round2(state["rate_30yr"] + delta_30)))
-    r15  = max(5.00, min(8.00, _round2(state["rate_15yr"] + delta_15)))
-    rarm = max(4.75, min(7.50, _round2(state["rate_arm"]  + delta_arm)))
+    delta = random.gauss(0, 0.03)   # ~3bp daily std deviation
+    r30, r15, rarm = (
+        max(lo, min(hi, _round2(state[key] + delta * factor)))
+        for key, factor, lo, hi in _SIM_TERMS
+    )
 
-    print(f"[Simulated] 30yr={r30}%  15yr={r15}%  ARM={rarm}%")
+    log.info("[Simulated] 30yr=%s%%  15yr=%s%%  ARM=%s%%", r30, r15, rarm)
     return r30, r15, rarm
 
 
@@ -181,7 +425,7 @@ def fetch_latest_rates() -> list[dict]:
     Main function called by the scheduler and the manual refresh endpoint.
     Returns a list of per-lender rate dicts ready for the DB.
     """
-    print(f"[RateUpdater] Fetching rates at {datetime.now(timezone.utc).isoformat()}")
+    log.info("[RateUpdater] Fetching rates")
 
     # Try FRED first (real data)
     result = _try_fred()
@@ -196,11 +440,18 @@ def fetch_latest_rates() -> list[dict]:
     _save_state({"rate_30yr": r30, "rate_15yr": r15, "rate_arm": rarm})
 
     lender_rates = _build_lender_rates(r30, r15, rarm)
-    print(f"[RateUpdater] Built rates for {len(lender_rates)} lenders")
+    log.info("[RateUpdater] Built rates for %d lenders", len(lender_rates))
     return lender_rates
 
 
+async def fetch_latest_rates_async() -> list[dict]:
+    """fetch_latest_rates() for async callers — runs in a worker thread so the
+    FRED calls, retries and state-file I/O never block the event loop."""
+    return await asyncio.to_thread(fetch_latest_rates)
+
+
 if __name__ == "__main__":
     # Quick manual test
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
     for r in fetch_latest_rates():
         print(f"  {r['lender_name']:35s}  30yr={r['rate_30yr']}%  APR={r['apr_30yr']}%")
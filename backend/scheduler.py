@@ -1,5 +1,5 @@
 """
-scheduler.py — APScheduler wrapper for the daily rate update job.
+scheduler.py — Runs the daily rate update job as an asyncio task.
 
 The job runs every day at 08:30 ET (when Freddie Mac typically releases
 its weekly Primary Mortgage Market Survey on Thursdays; other days we
@@ -9,89 +9,110 @@ You can override the run time via environment variables:
   RATE_JOB_HOUR   (default: 8)
   RATE_JOB_MINUTE (default: 30)
   RATE_JOB_TZ     (default: America/New_York)
+
+The task lives on the server's event loop and hands the blocking FRED fetch
+and DB upsert to worker threads, so start_scheduler() / stop_scheduler() must be
+called (and awaited) from async code such as the app lifespan.
 """
 
 import os
+import asyncio
 import logging
-from datetime import datetime, timezone
-
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
-from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR
+from contextlib import suppress
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
 
-from rate_updater import fetch_latest_rates
+from rate_updater import fetch_latest_rates_async
 from database import upsert_rates
 
 logger = logging.getLogger("scheduler")
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
-_scheduler: BackgroundScheduler | None = None
+_task: asyncio.Task | None = None
+_run: asyncio.Future | None = None      # in-flight _run_rate_update, if any
+_next_run: datetime | None = None
+
+# Schedule resolved once at import
+_HOUR    = int(os.getenv("RATE_JOB_HOUR",   "8"))
+_MINUTE  = int(os.getenv("RATE_JOB_MINUTE", "30"))
+_TZ_NAME = os.getenv("RATE_JOB_TZ", "America/New_York")
+_TZ = ZoneInfo(_TZ_NAME)
+
+# Longest single sleep — bounds how late a run can be after a clock jump
+# or host suspend.
+_MAX_SLEEP = 3600
 
 # ── Job definition ───────────────────────────────────────────────────────────
 
-def _run_rate_update():
+async def _run_rate_update():
     """The actual job payload — fetch new rates and persist them."""
     logger.info("⏰ Scheduled rate update starting…")
     try:
-        rates = fetch_latest_rates()
-        upsert_rates(rates)
+        rates = await fetch_latest_rates_async()
+        await asyncio.to_thread(upsert_rates, rates)
         logger.info(f"✅ Rate update complete — {len(rates)} lenders updated at "
                     f"{datetime.now(timezone.utc).isoformat()}")
     except Exception as exc:
+        # Logged and swallowed — a failed run must not end the daily loop
         logger.error(f"❌ Rate update FAILED: {exc}", exc_info=True)
-        raise  # re-raise so APScheduler marks the job as errored
 
 
-# ── Event listeners ──────────────────────────────────────────────────────────
+# ── Daily loop ───────────────────────────────────────────────────────────────
+
+def _next_fire(now: datetime, hour: int, minute: int) -> datetime:
+    """Next hour:minute wall-clock time in _TZ strictly after `now`."""
+    now = now.astimezone(_TZ)
+    fire = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if fire <= now:
+        fire += timedelta(days=1)
+    return fire
 
-def _on_job_executed(event):
-    logger.info(f"Job '{event.job_id}' executed successfully (retval={event.retval})")
 
-def _on_job_error(event):
-    logger.error(f"Job '{event.job_id}' raised an exception: {event.exception}")
+async def _daily_loop(hour: int, minute: int):
+    global _next_run, _run
+    while True:
+        _next_run = _next_fire(datetime.now(_TZ), hour, minute)
+        while (delay := (_next_run - datetime.now(timezone.utc)).total_seconds()) > 0:
+            await asyncio.sleep(min(delay, _MAX_SLEEP))
+        # Shielded: cancelling the loop can't abandon a run mid-upsert (its
+        # worker thread would keep going); stop_scheduler waits for it instead.
+        _run = asyncio.ensure_future(_run_rate_update())
+        await asyncio.shield(_run)
 
 
 # ── Public API ───────────────────────────────────────────────────────────────
 
 def start_scheduler():
-    global _scheduler
-
-    hour   = int(os.getenv("RATE_JOB_HOUR",   "8"))
-    minute = int(os.getenv("RATE_JOB_MINUTE", "30"))
-    tz     = os.getenv("RATE_JOB_TZ", "America/New_York")
-
-    _scheduler = BackgroundScheduler(timezone=tz)
-
-    _scheduler.add_listener(_on_job_executed, EVENT_JOB_EXECUTED)
-    _scheduler.add_listener(_on_job_error,    EVENT_JOB_ERROR)
-
-    _scheduler.add_job(
-        func        = _run_rate_update,
-        trigger     = CronTrigger(hour=hour, minute=minute, timezone=tz),
-        id          = "daily_rate_update",
-        name        = "Daily Mortgage Rate Update",
-        replace_existing = True,
-        misfire_grace_time = 3600,   # allow up to 1 hour late if server was down
-    )
-
-    _scheduler.start()
+    """Start the daily task; a no-op if it's already running on this loop."""
+    global _task, _next_run
+    loop = asyncio.get_running_loop()
+    if _task is not None and not _task.done() and _task.get_loop() is loop:
+        logger.info("Scheduler already running — not starting a second loop")
+        return
+
+    _next_run = _next_fire(datetime.now(_TZ), _HOUR, _MINUTE)
+    _task = loop.create_task(_daily_loop(_HOUR, _MINUTE), name="daily_rate_update")
     logger.info(
-        f"🗓  Scheduler started — daily rate update at {hour:02d}:{minute:02d} {tz}"
+        f"🗓  Scheduler started — daily rate update at {_HOUR:02d}:{_MINUTE:02d} {_TZ_NAME}"
     )
 
 
-def stop_scheduler():
-    global _scheduler
-    if _scheduler and _scheduler.running:
-        _scheduler.shutdown(wait=False)
+async def stop_scheduler():
+    """Cancel the daily task, waiting for an in-flight run to finish first."""
+    global _task, _next_run
+    if _task and not _task.done():
+        _task.cancel()
+        with suppress(asyncio.CancelledError):
+            await _task
         logger.info("Scheduler stopped.")
+    if _run is not None and not _run.done():
+        logger.info("Waiting for the running rate update to finish…")
+        await _run
+    _task = _next_run = None
 
 
 def get_next_run() -> str | None:
     """Returns ISO timestamp of the next scheduled run, or None."""
-    if not _scheduler:
+    if _task is None or _task.done() or _next_run is None:
         return None
-    job = _scheduler.get_job("daily_rate_update")
-    if job and job.next_run_time:
-        return job.next_run_time.isoformat()
-    return None
+    return _next_run.isoformat()